@@ -0,0 +1,4 @@
+"""Benchmarks for srtools. These are not installed with the package; run them
+from the root of the repository, e.g. ``python3 -m benchmarks.counts``.
+
+"""
@@ -0,0 +1,130 @@
+"""Runs the srtools benchmark scenarios on seeded synthetic data and writes the
+timings as JSON. Given the JSON of an earlier run with --compare, reports the
+scenarios which have become slower and exits with status 1 if there are any.
+Runs with a different scale, seed or parameters are not compared; the exit
+status is then 2.
+
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks import scenarios
+
+
+def run(data, names, repeat):
+    """Runs the named scenarios repeat times each, returning a dictionary of
+    scenario names to results.
+
+    """
+    results = {}
+    for name, function in scenarios.SCENARIOS:
+        if names and name not in names:
+            continue
+        times = []
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                items = function(data)
+                times.append(time.perf_counter() - start)
+        except scenarios.SkipScenario as e:
+            results[name] = {"skipped": str(e)}
+            print("{:20s} skipped: {}".format(name, e), file=sys.stderr)
+            continue
+        best = min(times)
+        results[name] = {"items": items,
+                         "best": best,
+                         "median": statistics.median(times),
+                         "items_per_second": items / best if best else None}
+        print("{:20s} {:10.3f}s {:12d} items".format(name, best, items),
+              file=sys.stderr)
+    return results
+
+
+def comparable(old, new):
+    """Returns None if the two runs used the same synthetic data, and a
+    description of the difference otherwise.
+
+    """
+    for key in ("scale", "seed", "parameters"):
+        if old.get(key) != new.get(key):
+            return "{} differs: {} != {}".format(key, old.get(key),
+                                                 new.get(key))
+    return None
+
+
+def regressions(old, new, tolerance):
+    """Returns a list of (name, old best, new best) for the scenarios whose
+    best time in the new results exceeds the old by more than the tolerance
+    fraction.
+
+    """
+    slower = []
+    for name, result in new["results"].items():
+        previous = old["results"].get(name, {})
+        if "best" in result and "best" in previous:
+            if result["best"] > previous["best"] * (1 + tolerance):
+                slower.append((name, previous["best"], result["best"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=sorted(scenarios.SCALES),
+                        default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", action="append", default=[],
+                        help="run only this scenario (may be repeated)")
+    parser.add_argument("--output", help="write the JSON results here "
+                                         "instead of to stdout")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    parameters = scenarios.SCALES[args.scale]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        data = scenarios.generate(tmp, parameters, args.seed)
+        print("generated {} data in {:.1f}s".format(
+            args.scale, time.perf_counter() - start), file=sys.stderr)
+        results = run(data, args.scenario, args.repeat)
+
+    report = {"scale": args.scale,
+              "seed": args.seed,
+              "repeat": args.repeat,
+              "parameters": parameters,
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "results": results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        difference = comparable(old, report)
+        if difference is not None:
+            print("Cannot compare with {}: {}".format(args.compare,
+                                                      difference),
+                  file=sys.stderr)
+            sys.exit(2)
+        slower = regressions(old, report, args.tolerance)
+        for name, before, after in slower:
+            print("REGRESSION {}: {:.3f}s -> {:.3f}s".format(name, before,
+                                                             after),
+                  file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
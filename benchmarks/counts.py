@@ -0,0 +1,136 @@
+"""Benchmark of srtools.counts.count_features on whole-genome-scale synthetic
+data. The counts are first checked against naive_count_features on a small,
+densely annotated data set with spliced reads and reads with deletions, under
+every strand and multi-overlap policy, and
+parallel counting is checked against serial counting with worker processes
+started by "spawn" (the default on macOS and Windows).
+
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from srtools import SamAlignment, counts, gff
+from benchmarks import generators
+
+
+# The shapes of the reads of the check: plain matches, spliced reads with
+# introns of various lengths, deletions and an insertion.
+CHECK_CIGARS = ["50M", "20M300N30M", "10M2000N30M100N10M", "25M3D25M",
+                "5S20M2I23M"]
+
+
+def check(tmp, rng, reads):
+    """Compares count_features with naive_count_features on a small synthetic
+    data set with many overlapping genes, raising AssertionError on any
+    difference.
+
+    """
+    gff_path = os.path.join(tmp, "check.gff")
+    sam_path = os.path.join(tmp, "check.sam")
+    generators.write_gff(gff_path, rng, 2, 40, 20000)
+    generators.write_single_reads(sam_path, rng, 2, reads, 20000,
+                                  cigars=CHECK_CIGARS)
+    annotation = gff.read_gff(gff_path)
+    chromosomes = generators.chromosome_map(2)
+    for strand, multi in itertools.product(counts.STRAND_POLICIES,
+                                           counts.MULTI_OVERLAP_POLICIES):
+        for f_type in ("gene", "mRNA"):
+            fast = counts.count_features(SamAlignment(sam_path), annotation,
+                                         f_type=f_type, strand=strand,
+                                         multi_overlap=multi,
+                                         chromosomes=chromosomes,
+                                         batch_size=50)
+            slow = counts.naive_count_features(SamAlignment(sam_path),
+                                               annotation, f_type=f_type,
+                                               strand=strand,
+                                               multi_overlap=multi,
+                                               chromosomes=chromosomes)
+            assert same_results(fast, slow), (strand, multi, f_type)
+
+
+def same_results(a, b):
+    """Returns True if two count_features results are equal, allowing for
+    rounding in the order fractional counts were summed.
+
+    """
+    rounded = [dict(r, counts={k: round(v, 9) for k, v in r["counts"].items()})
+               for r in (a, b)]
+    return rounded[0] == rounded[1]
+
+
+def check_parallel(tmp, rng, reads, processes):
+    """Compares count_features run serially and with a pool of spawned worker
+    processes, raising AssertionError on any difference.
+
+    """
+    gff_path = os.path.join(tmp, "parallel.gff")
+    sam_path = os.path.join(tmp, "parallel.sam")
+    generators.write_gff(gff_path, rng, 3, 200, 100000)
+    generators.write_single_reads(sam_path, rng, 3, reads, 100000)
+    annotation = gff.read_gff(gff_path)
+    chromosomes = generators.chromosome_map(3)
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        for multi in counts.MULTI_OVERLAP_POLICIES:
+            serial = counts.count_features(SamAlignment(sam_path), annotation,
+                                           multi_overlap=multi,
+                                           chromosomes=chromosomes)
+            parallel = counts.count_features(SamAlignment(sam_path),
+                                             annotation, multi_overlap=multi,
+                                             chromosomes=chromosomes,
+                                             processes=processes,
+                                             batch_size=500)
+            assert same_results(serial, parallel), multi
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chromosomes", type=int, default=5)
+    parser.add_argument("--length", type=int, default=30000000,
+                        help="length of each chromosome")
+    parser.add_argument("--genes", type=int, default=6000,
+                        help="genes per chromosome")
+    parser.add_argument("--reads", type=int, default=1000000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--sample", type=int, default=500,
+                        help="reads checked against the naive counter")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chromosomes = generators.chromosome_map(args.chromosomes)
+    with tempfile.TemporaryDirectory() as tmp:
+        check(tmp, rng, args.sample)
+        print("Checked against naive counts on {} reads".format(args.sample))
+        check_parallel(tmp, rng, 10 * args.sample, max(args.processes, 2))
+        print("Checked parallel (spawn) against serial counts")
+
+        gff_path = os.path.join(tmp, "synthetic.gff")
+        sam_path = os.path.join(tmp, "synthetic.sam")
+        generators.write_gff(gff_path, rng, args.chromosomes, args.genes,
+                             args.length)
+        generators.write_single_reads(sam_path, rng, args.chromosomes,
+                                      args.reads, args.length)
+        annotation = gff.read_gff(gff_path)
+
+        for processes in sorted(set([1, args.processes])):
+            start = time.perf_counter()
+            result = counts.count_features(SamAlignment(sam_path), annotation,
+                                           chromosomes=chromosomes,
+                                           processes=processes)
+            elapsed = time.perf_counter() - start
+            print("{:>2} process(es): {:8.2f}s {:>10.0f} reads/s "
+                  "({} assigned)".format(processes, elapsed,
+                                         args.reads / elapsed,
+                                         result["assigned"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Fast, seeded generators of synthetic FASTA, SAM, GFF and mpileup files.
+Every generator takes a random.Random instance, so the same seed always gives
+the same files.
+
+"""
+import bisect
+from srtools import sam, seq
+
+
+QUALITIES = "#+5?I"
+
+
+def reference_names(chromosomes):
+    """Returns the SAM reference names of the synthetic chromosomes."""
+    return ["Chr{}".format(c) for c in range(1, chromosomes + 1)]
+
+
+def make_references(rng, chromosomes, length):
+    """Returns a dictionary of random chromosome sequences."""
+    return {name: seq.random_sequence(length, rng)
+            for name in reference_names(chromosomes)}
+
+
+def write_fasta(path, references, width=60):
+    """Writes the reference sequences to a FASTA file."""
+    with open(path, "w") as f:
+        for name, sequence in references.items():
+            f.write(">" + name + "\n")
+            f.writelines(sequence[i:i + width] + "\n"
+                         for i in range(0, len(sequence), width))
+
+
+def mutate(rng, reference, pos, read_length, indel_rate):
+    """Returns a (sequence, cigar) pair for a read copied from the reference
+    at the zero-based position pos, with an insertion or a deletion in the
+    middle of the read with probability indel_rate. Helper function for
+    write_sam.
+
+    """
+    if rng.random() >= indel_rate:
+        return reference[pos:pos + read_length], "{}M".format(read_length)
+    n = rng.randint(1, 3)
+    left = rng.randint(read_length // 4, read_length // 2)
+    right = read_length - left
+    if rng.random() < 0.5:
+        right -= n
+        sequence = (reference[pos:pos + left] + seq.random_sequence(n, rng) +
+                    reference[pos + left:pos + left + right])
+        return sequence, "{}M{}I{}M".format(left, n, right)
+    sequence = (reference[pos:pos + left] +
+                reference[pos + left + n:pos + left + n + right])
+    return sequence, "{}M{}D{}M".format(left, n, right)
+
+
+def write_sam(path, rng, references, pairs, read_length=50,
+              insert_size=300, indel_rate=0.05, unmapped_rate=0.02,
+              cluster_spacing=5000, cluster_spread=300):
+    """Writes a coordinate-sorted SAM file of mate pairs drawn from the
+    reference sequences. Reads carry insertions and deletions at the given
+    rate, and a fraction of the pairs are left unmapped. Like expressed
+    transcripts, the pairs are clustered around loci cluster_spacing bases
+    apart, so that the alignment has separate expressed loci.
+
+    """
+    quality_pool = "".join(rng.choices(QUALITIES, k=4 * read_length))
+    records = []
+    serial = 0
+    for name, reference in references.items():
+        limit = len(reference) - insert_size - read_length
+        centres = range(cluster_spacing // 2, limit, cluster_spacing)
+        for _ in range(pairs // len(references)):
+            serial += 1
+            qname = "pair{}".format(serial)
+            if rng.random() < unmapped_rate:
+                sequence = seq.random_sequence(read_length, rng)
+                for flag in (77, 141):
+                    records.append((None, 0, "\t".join([
+                        qname, str(flag), "*", "0", "0", "*", "*", "0", "0",
+                        sequence, quality_pool[:read_length]])))
+                continue
+            pos = int(rng.gauss(rng.choice(centres), cluster_spread))
+            pos = min(max(pos, 0), limit)
+            mate_pos = pos + insert_size - read_length
+            reverse = rng.random() < 0.5
+            for first, p in ((True, pos), (False, mate_pos)):
+                sequence, cigar = mutate(rng, reference, p, read_length,
+                                         indel_rate)
+                if first:
+                    flag = 65 + 2 + (16 if reverse else 32)
+                    pnext, tlen = mate_pos + 1, insert_size
+                else:
+                    flag = 129 + 2 + (32 if reverse else 16)
+                    pnext, tlen = pos + 1, -insert_size
+                q = rng.randrange(3 * read_length)
+                records.append((name, p + 1, "\t".join([
+                    qname, str(flag), name, str(p + 1), "60", cigar, "=",
+                    str(pnext), str(tlen), sequence,
+                    quality_pool[q:q + len(sequence)], "NM:i:0"])))
+
+    order = {name: i for i, name in enumerate(references)}
+    order[None] = len(order)        # Unmapped reads go at the end.
+    records.sort(key=lambda r: (order[r[0]], r[1]))
+    with open(path, "w") as f:
+        f.write("@HD\tVN:1.0\tSO:coordinate\n")
+        for name, reference in references.items():
+            f.write("@SQ\tSN:{}\tLN:{}\n".format(name, len(reference)))
+        f.writelines(r[2] + "\n" for r in records)
+
+
+def write_single_reads(path, rng, chromosomes, reads, length,
+                       read_length=50, cigars=None):
+    """Writes a coordinate-sorted SAM file of unpaired reads with random
+    positions, strands and placeholder sequences, a fifth of which are
+    unmapped. This is much faster than write_sam when only the positions of
+    the reads matter. The reads are all read_length matches, unless cigars is
+    a list of cigar strings, in which case each read is given one of them at
+    random (e.g. "20M300N30M" for a spliced read).
+
+    """
+    if cigars is None:
+        cigars = ["{}M".format(read_length)]
+    records = [(c, "A" * sam.parse_cigar(c).query_length,
+                "I" * sam.parse_cigar(c).query_length) for c in cigars]
+    per_chromosome = reads // chromosomes
+    with open(path, "w") as f:
+        f.write("@HD\tVN:1.0\tSO:coordinate\n")
+        for c, name in enumerate(reference_names(chromosomes), 1):
+            positions = sorted(rng.randint(1, length)
+                               for _ in range(per_chromosome))
+            flags = rng.choices((0, 16, 0, 16, 4), k=per_chromosome)
+            if len(records) == 1:
+                shapes = records * per_chromosome
+            else:
+                shapes = rng.choices(records, k=per_chromosome)
+            f.writelines("\t".join(["r{}_{}".format(c, i), str(flag), name,
+                                    str(pos), "60", cigar, "*", "0", "0",
+                                    sequence, quality]) + "\n"
+                         for i, (pos, flag, (cigar, sequence, quality))
+                         in enumerate(zip(positions, flags, shapes)))
+
+
+def write_gff(path, rng, chromosomes, genes, length):
+    """Writes a GFF3 annotation of genes on each chromosome, each gene with
+    two transcripts of two exons. The GFF sequence names are the chromosome
+    numbers ("1", "2", ...), as in TAIR annotations.
+
+    """
+    spacing = length // genes
+    with open(path, "w") as f:
+        f.write("##gff-version 3\n")
+        for c in range(1, chromosomes + 1):
+            for g in range(genes):
+                start = g * spacing + rng.randint(1, spacing // 4)
+                end = start + rng.randint(spacing // 4, spacing)
+                strand = rng.choice("+-")
+                gene_id = "G{}_{}".format(c, g)
+                lines = [[str(c), "synth", "gene", start, end, ".", strand,
+                          ".", "ID=" + gene_id]]
+                for t in (1, 2):
+                    mrna_id = "{}.{}".format(gene_id, t)
+                    lines.append([str(c), "synth", "mRNA", start, end, ".",
+                                  strand, ".",
+                                  "ID={};Parent={}".format(mrna_id, gene_id)])
+                    middle = rng.randint(start, end)
+                    for e0, e1 in ((start, middle), (middle + 50, end)):
+                        if e0 <= e1:
+                            lines.append([str(c), "synth", "exon", e0, e1,
+                                          ".", strand, ".",
+                                          "Parent=" + mrna_id])
+                f.writelines("\t".join([str(x) for x in line]) + "\n"
+                             for line in lines)
+
+
+def chromosome_map(chromosomes):
+    """Returns the dictionary mapping the SAM reference names written by these
+    generators to the GFF sequence names written by write_gff.
+
+    """
+    return {name: str(c)
+            for c, name in enumerate(reference_names(chromosomes), 1)}
+
+
+def write_pileup(path, rng, references, positions, depth=20):
+    """Writes a pileup file covering the given number of positions, spread
+    evenly across the reference sequences, in the six-column layout read by
+    srtools.pileup (mpileup output without the depth column).
+
+    """
+    quality_pool = "".join(rng.choices(QUALITIES, k=4 * depth))
+    mapq_pool = "".join(rng.choices("]<?", k=4 * depth))
+    names = list(references)
+    lengths = [len(references[n]) for n in names]
+    cumulative = []
+    total = 0
+    for n in lengths:
+        total += n
+        cumulative.append(total)
+    step = max(total // positions, 1)
+    with open(path, "w") as f:
+        for offset in range(0, min(positions * step, total), step):
+            i = bisect.bisect_right(cumulative, offset)
+            coordinate = offset - (cumulative[i - 1] if i else 0)
+            base = references[names[i]][coordinate]
+            n = rng.randint(1, depth)
+            bases = "".join(rng.choices(".,.,.,ACGT", k=n))
+            q = rng.randrange(3 * depth)
+            f.write("\t".join([names[i], str(coordinate + 1), base, bases,
+                               quality_pool[q:q + n], mapq_pool[q:q + n]])
+                    + "\n")
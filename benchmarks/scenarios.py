@@ -0,0 +1,192 @@
+"""Timed benchmark scenarios over the synthetic data of benchmarks.generators.
+Each scenario takes the data dictionary returned by generate and returns the
+number of items it processed.
+
+"""
+import os
+import random
+from srtools import SamAlignment, counts, expressed_loci, gff, sam, seq, stats
+from srtools.pileup import Pileup
+from benchmarks import generators
+
+
+SCALES = {"small": {"chromosomes": 2, "length": 200000, "pairs": 20000,
+                    "genes": 200, "pileup": 50000},
+          "medium": {"chromosomes": 5, "length": 2000000, "pairs": 250000,
+                     "genes": 2000, "pileup": 500000},
+          "large": {"chromosomes": 5, "length": 30000000, "pairs": 2500000,
+                    "genes": 30000, "pileup": 5000000}}
+
+
+class SkipScenario(Exception):
+    """The exception raised by a scenario which cannot run here, for example
+    because an optional dependency is missing.
+
+    """
+    pass
+
+
+def generate(directory, parameters, seed):
+    """Writes the synthetic data files for the parameters (one of SCALES)
+    into the directory and returns the data dictionary used by the
+    scenarios.
+
+    """
+    rng = random.Random(seed)
+    data = dict(parameters)
+    data["fasta"] = os.path.join(directory, "reference.fa")
+    data["sam"] = os.path.join(directory, "reads.sam")
+    data["gff"] = os.path.join(directory, "genes.gff")
+    data["gff_cache"] = os.path.join(directory, "genes.gff.cache")
+    data["pileup_file"] = os.path.join(directory, "reads.pileup")
+
+    references = generators.make_references(rng, parameters["chromosomes"],
+                                            parameters["length"])
+    generators.write_fasta(data["fasta"], references)
+    generators.write_sam(data["sam"], rng, references, parameters["pairs"])
+    generators.write_gff(data["gff"], rng, parameters["chromosomes"],
+                         parameters["genes"], parameters["length"])
+    generators.write_pileup(data["pileup_file"], rng, references,
+                            parameters["pileup"])
+    data["chromosome_map"] = generators.chromosome_map(
+        parameters["chromosomes"])
+    data["annotation"] = prepared_annotation(data["gff"])
+    gff.read_gff(data["gff"], data["gff_cache"])
+    return data
+
+
+def prepared_annotation(path):
+    """Returns the annotation of the GFF file with the indexes used by the
+    in_features and count_features scenarios already built. The scenarios
+    share one annotation, so indexes built on first use would be timed in
+    the first repeat only and left out of the best time. Building them here
+    means these scenarios time queries alone; the read_gff scenarios time
+    parsing.
+
+    """
+    annotation = gff.read_gff(path)
+    annotation.index("sequence")
+    annotation.index("f_type")
+    for sequence in annotation.index("sequence"):
+        annotation.overlapping(sequence, 0, 0, "exon")
+    annotation.hierarchy()
+    return annotation
+
+
+def mapped_chromosomes(alignment):
+    """Returns a generator of the reads of each chromosome of the alignment,
+    leaving out unmapped reads.
+
+    """
+    for group in alignment.collect_reads("rname"):
+        reads = [r for r in group if r.pos != 0]
+        if reads:
+            yield reads
+
+
+def has_indel(read):
+    return read.cigar.has_insertion or read.cigar.has_deletion
+
+
+def parse_sam(data):
+    return sum(1 for _ in SamAlignment(data["sam"]))
+
+
+def filter_reads(data):
+    return sum(1 for _ in SamAlignment(data["sam"]).filter_reads(has_indel))
+
+
+def find_expressed_loci(data):
+    loci = 0
+    for reads in mapped_chromosomes(SamAlignment(data["sam"])):
+        loci += sum(1 for _ in expressed_loci(reads))
+    return loci
+
+
+def consensus(data, reads_per_call=20, calls=2000):
+    alignment = SamAlignment(data["sam"])
+    n = 0
+    for rname, reads in alignment.collect_read_batches("rname",
+                                                       reads_per_call):
+        if rname == "*":
+            continue
+        sam.consensus(reads)
+        n += 1
+        if n == calls:
+            break
+    return n
+
+
+def summary_statistics(data):
+    return stats.summary_statistics(SamAlignment(data["sam"]))["read_count"]
+
+
+def in_features(data):
+    annotation = data["annotation"]
+    loci = 0
+    for reads in mapped_chromosomes(SamAlignment(data["sam"])):
+        genes = annotation.filter_features(
+            sequence=data["chromosome_map"][reads[0].rname], f_type="gene")
+        for locus in expressed_loci(reads):
+            gff.in_features(locus, genes)
+            loci += 1
+    return loci
+
+
+def count_features(data):
+    result = counts.count_features(SamAlignment(data["sam"]),
+                                   data["annotation"],
+                                   chromosomes=data["chromosome_map"])
+    return result["assigned"]
+
+
+def read_gff(data):
+    return len(gff.read_gff(data["gff"]).features)
+
+
+def read_gff_cached(data):
+    return len(gff.read_gff(data["gff"], data["gff_cache"]).features)
+
+
+def read_fasta(data):
+    return sum(len(s) for s in seq.read_fasta(data["fasta"]).values())
+
+
+def parse_pileup(data):
+    return sum(1 for _ in Pileup(data["pileup_file"]))
+
+
+def postgres_sql(data):
+    from srtools import postgres
+    n = 0
+    for n, read in enumerate(SamAlignment(data["sam"]), 1):
+        postgres.sql_insert_command(read, "reads", n)
+    return n
+
+
+def postgres_dump(data):
+    locator = os.environ.get("SRTOOLS_BENCH_POSTGRES")
+    if not locator:
+        raise SkipScenario("set SRTOOLS_BENCH_POSTGRES to a pg locator")
+    from srtools import postgres
+    alignment = SamAlignment(data["sam"])
+    try:
+        postgres.postgres_dump(alignment, locator)
+    except ImportError as e:            # The driver is imported on connecting.
+        raise SkipScenario(str(e))
+    return parse_sam(data)
+
+
+SCENARIOS = [("parse_sam", parse_sam),
+             ("filter_reads", filter_reads),
+             ("expressed_loci", find_expressed_loci),
+             ("consensus", consensus),
+             ("summary_statistics", summary_statistics),
+             ("in_features", in_features),
+             ("count_features", count_features),
+             ("read_gff", read_gff),
+             ("read_gff_cached", read_gff_cached),
+             ("read_fasta", read_fasta),
+             ("parse_pileup", parse_pileup),
+             ("postgres_sql", postgres_sql),
+             ("postgres_dump", postgres_dump)]
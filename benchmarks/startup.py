@@ -0,0 +1,106 @@
+"""Measures the cold import cost of srtools in fresh interpreters, using
+``python -X importtime``: the time spent importing modules which a bare
+interpreter does not import. Every statement has a budget in milliseconds;
+exits with status 1 if any statement takes longer than its budget, or if
+importing srtools.postgres imports the postgres driver.
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Statements and the milliseconds allowed for each, about twice their cost on
+# a typical development machine.
+BUDGETS = [("import srtools", 5.0),
+           ("from srtools import SamAlignment", 20.0),
+           ("import srtools.gff", 25.0),
+           ("import srtools.counts", 30.0),
+           ("import srtools.stats", 12.0),
+           ("import srtools.postgres", 20.0)]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(statement):
+    """Runs the statement in a fresh interpreter with -X importtime and
+    returns a dictionary of the names of the modules it imported to the
+    microseconds spent in each (excluding their own imports).
+
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                              statement],
+                             cwd=ROOT, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        if self_time.strip().isdigit():     # Skips the header line.
+            times[name.strip()] = int(self_time)
+    return times
+
+
+def import_cost(statement, baseline):
+    """Returns a tuple of the microseconds the statement spends importing
+    modules not imported by a bare interpreter, and the names of those
+    modules.
+
+    """
+    times = import_times(statement)
+    modules = set(times) - baseline
+    return sum(times[m] for m in modules), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-scale", type=float, default=1.0,
+                        help="multiply every budget by this factor, for "
+                             "slower machines")
+    parser.add_argument("--output", help="write the JSON results here "
+                                         "instead of to stdout")
+    args = parser.parse_args()
+
+    baseline = set(import_times("pass"))
+    results = {}
+    failures = []
+    for statement, budget in BUDGETS:
+        budget *= args.budget_scale
+        times = []
+        for _ in range(args.runs):
+            microseconds, modules = import_cost(statement, baseline)
+            times.append(microseconds / 1000)
+        results[statement] = {"best_ms": min(times),
+                              "median_ms": sorted(times)[len(times) // 2],
+                              "budget_ms": budget,
+                              "modules": len(modules)}
+        print("{:40s} {:8.2f} ms (budget {:.1f} ms)".format(
+            statement, min(times), budget), file=sys.stderr)
+        if min(times) > budget:
+            failures.append("{} took {:.2f} ms (budget {:.1f} ms)".format(
+                statement, min(times), budget))
+        if "postgresql" in modules:
+            failures.append(statement + " imported the postgres driver")
+
+    output = json.dumps({"budget_scale": args.budget_scale,
+                         "runs": args.runs,
+                         "results": results,
+                         "failures": failures}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    for failure in failures:
+        print("FAILED " + failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
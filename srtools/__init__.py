@@ -1,5 +1,27 @@
-from srtools import sam
+# The package imports its modules on first use, so that short-lived processes
+# only pay for the modules they need.
 
-Alignment = sam.Alignment
-SamAlignment = sam.SamAlignment
-expressed_loci = sam.expressed_loci
+_ATTRIBUTES = {"Alignment": "sam",
+               "SamAlignment": "sam",
+               "expressed_loci": "sam"}
+
+_SUBMODULES = ("counts", "gff", "instrument", "pileup", "postgres", "sam",
+               "seq", "stats")
+
+
+def __getattr__(name):
+    import importlib
+    if name in _ATTRIBUTES:
+        module = importlib.import_module("srtools." + _ATTRIBUTES[name])
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module("srtools." + name)
+    else:
+        raise AttributeError("module 'srtools' has no attribute " +
+                             repr(name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_ATTRIBUTES) | set(_SUBMODULES))
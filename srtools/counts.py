@@ -0,0 +1,251 @@
+from collections import Counter
+from srtools import gff, sam
+
+
+STRAND_POLICIES = ("unstranded", "stranded", "reverse")
+MULTI_OVERLAP_POLICIES = ("all", "unique", "fraction")
+
+
+class CountOptions(object):
+    """The settings of a read-counting run. See count_features."""
+    def __init__(self, f_type="gene", exon_type="exon", strand="unstranded",
+                 multi_overlap="unique", chromosomes=None):
+        if strand not in STRAND_POLICIES:
+            raise ValueError("Unknown strand policy: " + str(strand))
+        if multi_overlap not in MULTI_OVERLAP_POLICIES:
+            raise ValueError("Unknown multi-overlap policy: " +
+                             str(multi_overlap))
+        self.f_type = f_type
+        self.exon_type = exon_type
+        self.strand = strand
+        self.multi_overlap = multi_overlap
+        self.chromosomes = chromosomes
+
+    def sequence_name(self, rname):
+        """Returns the GFF sequence name corresponding to an rname."""
+        if self.chromosomes is None:
+            return rname
+        return self.chromosomes.get(rname, rname)
+
+
+def read_strand(read):
+    """Returns "-" if the read is mapped to the reverse strand according to
+    its bitflag, and "+" otherwise.
+
+    """
+    if read.flag & 16:
+        return "-"
+    return "+"
+
+
+def strand_matches(feature_strand, strand, policy):
+    """Returns True if a read on the given strand may be assigned to a feature
+    on feature_strand under the strand policy. Features with no strand match
+    reads on either strand.
+
+    """
+    if policy == "unstranded" or feature_strand not in ("+", "-"):
+        return True
+    if policy == "stranded":
+        return feature_strand == strand
+    return feature_strand != strand
+
+
+def feature_id(feature):
+    """Returns the key under which reads assigned to the feature are counted:
+    its ID attribute, or its Name attribute, or failing both its location as
+    "sequence:start-end". Exons often have only a Parent attribute, as in
+    TAIR and Ensembl GFF3 files.
+
+    """
+    attributes = feature.attributes
+    key = attributes.get("ID") or attributes.get("Name")
+    if key is None:
+        key = "{}:{}-{}".format(feature.sequence, feature.start, feature.end)
+    return key
+
+
+def add_assignment(counts, summary, ids, policy):
+    """Adds one read which overlaps the features with the given IDs to the
+    counts and the summary, according to the multi-overlap policy.
+
+    """
+    if not ids:
+        summary["unassigned_no_features"] += 1
+    elif len(ids) == 1 or policy == "all":
+        for i in ids:
+            counts[i] += 1
+        summary["assigned"] += 1
+    elif policy == "fraction":
+        for i in ids:
+            counts[i] += 1 / len(ids)
+        summary["assigned"] += 1
+    else:
+        summary["unassigned_ambiguity"] += 1
+
+
+def count_batch(annotation, options, reads):
+    """Counts a batch of reads, returning a tuple of the feature counts and
+    the summary counts of the batch. The features containing each exon are
+    looked up once per batch, by gff.feature_hits.
+
+    """
+    counts = Counter()
+    summary = Counter()
+    ancestors = {}          # The features of type f_type containing each
+                            # exon, shared by the reads of the batch.
+    for read in reads:
+        if read.flag & 4 or read.pos == 0:
+            summary["unassigned_unmapped"] += 1
+            continue
+        sequence = options.sequence_name(read.rname)
+        strand = read_strand(read)
+        ids = set()
+        for start, end in read.aligned_blocks():
+            for f in gff.feature_hits(annotation, sequence, start, end,
+                                      options.f_type, options.exon_type,
+                                      ancestors):
+                if strand_matches(f.strand, strand, options.strand):
+                    ids.add(feature_id(f))
+        add_assignment(counts, summary, sorted(ids), options.multi_overlap)
+    return counts, summary
+
+
+_worker_state = {}
+
+
+def _init_worker(annotation, options):
+    _worker_state["annotation"] = annotation
+    _worker_state["options"] = options
+
+
+def _count_lines_in_worker(lines):
+    reads = (sam.parse_sam_read(line) for line in lines)
+    return count_batch(_worker_state["annotation"], _worker_state["options"],
+                       reads)
+
+
+def count_features(alignment, annotation, f_type="gene", exon_type="exon",
+                   strand="unstranded", multi_overlap="unique",
+                   chromosomes=None, processes=1, batch_size=10000):
+    """Counts the reads of an alignment overlapping each feature of the
+    annotation in a single pass, in the manner of featureCounts. A read is
+    assigned to a feature of type f_type (e.g. "gene" or "mRNA") if one of
+    its aligned blocks overlaps one of the feature's exons, so the blocks of
+    a spliced read are looked up separately and the intron between them is
+    not. Returns a dictionary with the keys:
+
+        "counts":                   a Counter of the number of reads assigned
+                                    to each feature, keyed by feature_id
+        "assigned":                 the number of reads assigned to features
+        "unassigned_unmapped":      the number of unmapped reads
+        "unassigned_no_features":   the number of reads overlapping no feature
+        "unassigned_ambiguity":     the number of reads not assigned because
+                                    they overlap several features
+
+    The strand policy is one of:
+
+        "unstranded":   reads are counted regardless of strand
+        "stranded":     reads must be on the same strand as the feature
+        "reverse":      reads must be on the opposite strand to the feature
+
+    and the multi_overlap policy, for reads overlapping several features, one
+    of:
+
+        "unique":       the read is not counted
+        "all":          the read is counted once for each feature
+        "fraction":     each feature is credited 1/n of a read
+
+    The rnames of the reads are used as GFF sequence names, unless
+    chromosomes is a dictionary mapping rnames to sequence names.
+
+    With processes > 1, the alignment must be a SamAlignment. Its file is
+    read from the beginning in batches of batch_size unparsed lines, which
+    are sent to a pool of worker processes to be parsed and counted, so that
+    parsing runs in parallel too. Each worker receives a copy of the
+    annotation when it starts.
+
+    """
+    options = CountOptions(f_type, exon_type, strand, multi_overlap,
+                           chromosomes)
+    if processes > 1:
+        if not hasattr(alignment, "line_batches"):
+            raise ValueError("Parallel counting needs a SamAlignment!")
+        import multiprocessing
+        # Build the indexes before the workers are started, so that workers
+        # receive them with the annotation instead of each rebuilding them.
+        for sequence in set(f.sequence for f in annotation.features):
+            annotation.overlapping(sequence, 0, 0, exon_type)
+        annotation.hierarchy()
+        counts = Counter()
+        summary = Counter()
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (annotation, options)) as pool:
+            results = pool.imap_unordered(_count_lines_in_worker,
+                                          alignment.line_batches(batch_size))
+            for batch_counts, batch_summary in results:
+                counts.update(batch_counts)
+                summary.update(batch_summary)
+    else:
+        counts, summary = count_batch(annotation, options, alignment)
+
+    result = {"counts": counts,
+              "assigned": 0,
+              "unassigned_unmapped": 0,
+              "unassigned_no_features": 0,
+              "unassigned_ambiguity": 0}
+    result.update(summary)
+    return result
+
+
+def naive_count_features(reads, annotation, f_type="gene", exon_type="exon",
+                         strand="unstranded", multi_overlap="unique",
+                         chromosomes=None):
+    """A slow reference implementation of count_features, which compares
+    every read with every feature and follows Parent attributes by scanning
+    the annotation. Useful only for checking count_features on small data.
+
+    """
+    options = CountOptions(f_type, exon_type, strand, multi_overlap,
+                           chromosomes)
+    counts = Counter()
+    summary = Counter()
+
+    def ancestors(feature):
+        found = []
+        parents = feature.attributes.get("Parent")
+        for parent_id in (parents.split(",") if parents else []):
+            for f in annotation.features:
+                if f.attributes.get("ID") == parent_id:
+                    found.append(f)
+                    found.extend(ancestors(f))
+        return found
+
+    for read in reads:
+        if read.flag & 4 or read.pos == 0:
+            summary["unassigned_unmapped"] += 1
+            continue
+        sequence = options.sequence_name(read.rname)
+        blocks = read.aligned_blocks()
+        hits = []
+        for exon in annotation.features:
+            if (exon.f_type == exon_type and exon.sequence == sequence
+                    and any(exon.start <= end and exon.end >= start
+                            for start, end in blocks)):
+                if f_type == exon_type:
+                    hits.append(exon)
+                else:
+                    hits.extend(f for f in ancestors(exon)
+                                if f.f_type == f_type)
+        ids = sorted(set(feature_id(f) for f in hits
+                         if strand_matches(f.strand, read_strand(read),
+                                           strand)))
+        add_assignment(counts, summary, ids, multi_overlap)
+
+    result = {"counts": counts,
+              "assigned": 0,
+              "unassigned_unmapped": 0,
+              "unassigned_no_features": 0,
+              "unassigned_ambiguity": 0}
+    result.update(summary)
+    return result
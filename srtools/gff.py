@@ -1,5 +1,18 @@
+import bisect
+import gc
+import os
+import sys
+from array import array
 from srtools import sam
 
+
+GFF_CACHE_VERSION = 2
+
+# The indexes stored in the GFF cache. These are the ones keyed by attributes,
+# which are slow to build because every attribute column must be parsed.
+CACHED_INDEXES = ("ID", "Parent")
+
+
 class Feature(object):
     """A GFF genomic feature."""
     def __init__(self, sequence, source, f_type, start, end, score,
@@ -13,6 +26,19 @@ class Feature(object):
         self.strand = strand
         self.frame = frame
         self.attribute = attribute
+        self._attributes = None
+        self._position = None
+
+    @property
+    def attributes(self):
+        """A dictionary of the parsed attribute column. Both GFF3 (ID=gene1)
+        and GTF (gene_id "gene1") styles are understood. The attribute string
+        is parsed the first time this property is used.
+
+        """
+        if self._attributes is None:
+            self._attributes = parse_attributes(self.attribute)
+        return self._attributes
 
 
 class GenomeAnnotation(object):
@@ -20,13 +46,87 @@ class GenomeAnnotation(object):
     def __init__(self, head, features):
         self.head = head
         self.features = features
+        self._indexes = {}
+        self._intervals = {}
+        self._hierarchy = None
+
+    def index(self, key):
+        """Returns a dictionary mapping each value of key to the list of
+        features with that value, in annotation order. The key may be a
+        Feature field (e.g. "f_type" or "sequence") or an attribute name
+        (e.g. "ID" or "Parent"). Comma-separated attribute values, as in
+        features with several parents, are indexed under each value. Indexes
+        are built on first use; call reindex after modifying the features.
+
+        """
+        try:
+            return self._indexes[key]
+        except KeyError:
+            pass
+        index = {}
+        for f in self.features:
+            for value in feature_values(f, key):
+                index.setdefault(value, []).append(f)
+        self._indexes[key] = index
+        return index
+
+    def reindex(self):
+        """Discards the indexes, which are rebuilt when next used."""
+        self._indexes = {}
+        self._intervals = {}
+        self._hierarchy = None
+
+    def hierarchy(self):
+        """Returns the FeatureHierarchy of the annotation, building it on
+        first use.
 
-    def filter_features(self, function):
+        """
+        if self._hierarchy is None:
+            self._hierarchy = FeatureHierarchy(self.features)
+        return self._hierarchy
+
+    def overlapping(self, sequence, start, end, f_type=None):
+        """Returns a list of the features on the sequence which share at least
+        one base with the range from start to end (inclusive), ordered by
+        start position. If f_type is given, only features of that type are
+        returned.
+
+        """
+        key = (sequence, f_type)
+        try:
+            interval_index = self._intervals[key]
+        except KeyError:
+            criteria = {"sequence": sequence}
+            if f_type is not None:
+                criteria["f_type"] = f_type
+            interval_index = IntervalIndex(self.filter_features(**criteria))
+            self._intervals[key] = interval_index
+        return interval_index.overlapping(start, end)
+
+    def filter_features(self, function=None, **criteria):
         """Returns a list of features where function(feature) reutrns a truthy
-        value.
+        value. Keyword arguments restrict the features to those with the given
+        value for a field or attribute, for example::
+
+            annotation.filter_features(sequence="1", f_type="gene")
+
+        These are answered from the indexes rather than by scanning the whole
+        annotation.
 
         """
-        return [f for f in self.features if function(f)]
+        if not criteria:
+            candidates = self.features
+        else:
+            matches = [(k, v, self.index(k).get(v, []))
+                       for k, v in criteria.items()]
+            matches.sort(key=lambda x: len(x[2]))
+            candidates = matches[0][2]
+            for k, v, _ in matches[1:]:
+                candidates = [f for f in candidates
+                              if v in feature_values(f, k)]
+        if function is None:
+            return list(candidates)
+        return [f for f in candidates if function(f)]
 
     def collect_features(self, function):
         """Returns a generator which yields lists of consecutive features which
@@ -43,15 +143,259 @@ class GenomeAnnotation(object):
         yield collection
 
 
+class IntervalIndex(object):
+    """A static index of features by position, for overlap queries. Features
+    are sorted by start and split into classes by length. A query only has
+    to look at the features of each class starting within the longest length
+    of that class before it, so a few very long features, such as the
+    chromosome rows of TAIR annotations, do not slow down queries among short
+    ones.
+
+    Lengths are first classed within a factor of four, and neighbouring
+    classes are then merged while that costs a query fewer extra features to
+    scan (on average over the span of the features) than the MERGE_SCAN
+    features an extra class costs to search.
+
+    """
+    MERGE_SCAN = 4
+
+    def __init__(self, features):
+        self.features = sorted(features, key=lambda f: f.start)
+        span = 1
+        if self.features:
+            span = max(self.features[-1].start - self.features[0].start, 1)
+        classes = {}
+        for i, f in enumerate(self.features):
+            length = max(f.end - f.start, 0)
+            classes.setdefault(length.bit_length() // 2, []).append(i)
+        merged = []
+        current = None
+        for key in sorted(classes):
+            positions = classes[key]
+            if current is not None:
+                extra = len(current) * (self.longest(positions) -
+                                        self.longest(current))
+                if extra <= self.MERGE_SCAN * span:
+                    positions = current + positions
+                else:
+                    merged.append(current)
+            current = positions
+        if current is not None:
+            merged.append(current)
+        self.classes = []
+        for positions in merged:
+            positions.sort()
+            self.classes.append((self.longest(positions),
+                                 [self.features[i].start for i in positions],
+                                 positions))
+
+    def longest(self, positions):
+        """Returns the greatest length of the features at the positions."""
+        return max(self.features[i].end - self.features[i].start
+                   for i in positions)
+
+    def overlapping(self, start, end):
+        """Returns a list of the features sharing at least one base with the
+        range from start to end (inclusive), ordered by start.
+
+        """
+        features = self.features
+        if len(self.classes) == 1:
+            max_length, starts, _ = self.classes[0]
+            lo = bisect.bisect_left(starts, start - max_length)
+            hi = bisect.bisect_right(starts, end)
+            return [f for f in features[lo:hi] if f.end >= start]
+        found = []
+        for max_length, starts, positions in self.classes:
+            lo = bisect.bisect_left(starts, start - max_length)
+            hi = bisect.bisect_right(starts, end)
+            found.extend(i for i in positions[lo:hi]
+                         if features[i].end >= start)
+        found.sort()
+        return [features[i] for i in found]
+
+
+class FeatureHierarchy(object):
+    """The parent/child graph of a list of features, as given by the GFF3 ID
+    and Parent attributes (gene -> mRNA -> exon, for example).
+
+    Features are numbered by their position in the list and the edges are
+    kept as compressed adjacency arrays: the children of feature i are
+    child_indices[child_offsets[i]:child_offsets[i + 1]], and likewise for
+    parents. Finding the children or parents of a feature takes constant time
+    plus the size of the result. Each feature records its own position, so
+    the hierarchy still works after being pickled, e.g. when it is sent to
+    another process.
+
+    """
+    def __init__(self, features, arrays=None):
+        self.features = features
+        for i, f in enumerate(features):
+            f._position = i
+        if arrays is not None:
+            (self.child_offsets, self.child_indices,
+             self.parent_offsets, self.parent_indices) = arrays
+            return
+
+        ids = {}
+        edges = []
+        for i, f in enumerate(features):
+            attributes = f.attributes
+            if "ID" in attributes:
+                ids[attributes["ID"]] = i
+            if "Parent" in attributes:
+                edges.extend((p, i) for p in attributes["Parent"].split(","))
+        edges = [(ids[p], c) for p, c in edges if p in ids]
+
+        self.child_offsets, self.child_indices = adjacency_arrays(
+            len(features), edges)
+        self.parent_offsets, self.parent_indices = adjacency_arrays(
+            len(features), [(c, p) for p, c in edges])
+
+    def arrays(self):
+        """Returns the adjacency arrays of the hierarchy, from which it can be
+        rebuilt over the same features with FeatureHierarchy(features,
+        arrays).
+
+        """
+        return (self.child_offsets, self.child_indices,
+                self.parent_offsets, self.parent_indices)
+
+    def position(self, feature):
+        """Returns the index of the feature in the hierarchy. A feature which
+        has since been numbered by another hierarchy is looked up by a
+        search of the feature list.
+
+        """
+        i = feature._position
+        if i is None or i >= len(self.features) or \
+                self.features[i] is not feature:
+            i = self.features.index(feature)
+        return i
+
+    def children(self, feature, f_type=None):
+        """Returns a list of the direct children of the feature, optionally
+        restricted to those of type f_type.
+
+        """
+        i = self.position(feature)
+        return self._related(self.child_offsets, self.child_indices, i, f_type)
+
+    def parents(self, feature, f_type=None):
+        """Returns a list of the direct parents of the feature, optionally
+        restricted to those of type f_type.
+
+        """
+        i = self.position(feature)
+        return self._related(self.parent_offsets, self.parent_indices, i,
+                             f_type)
+
+    def descendants(self, feature, f_type=None):
+        """Returns a list of all the features below the feature in the
+        hierarchy, optionally restricted to those of type f_type.
+
+        """
+        return self._closure(self.child_offsets, self.child_indices, feature,
+                             f_type)
+
+    def ancestors(self, feature, f_type=None):
+        """Returns a list of all the features above the feature in the
+        hierarchy, optionally restricted to those of type f_type.
+
+        """
+        return self._closure(self.parent_offsets, self.parent_indices,
+                             feature, f_type)
+
+    def roots(self, f_type=None):
+        """Returns a list of the features which have no parents, optionally
+        restricted to those of type f_type.
+
+        """
+        offsets = self.parent_offsets
+        return [f for i, f in enumerate(self.features)
+                if offsets[i] == offsets[i + 1]
+                and (f_type is None or f.f_type == f_type)]
+
+    def _related(self, offsets, indices, i, f_type):
+        related = [self.features[j]
+                   for j in indices[offsets[i]:offsets[i + 1]]]
+        if f_type is not None:
+            related = [f for f in related if f.f_type == f_type]
+        return related
+
+    def _closure(self, offsets, indices, feature, f_type):
+        seen = set()
+        stack = [self.position(feature)]
+        while stack:
+            i = stack.pop()
+            for j in indices[offsets[i]:offsets[i + 1]]:
+                if j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+        return [self.features[j] for j in sorted(seen)
+                if f_type is None or self.features[j].f_type == f_type]
+
+
+def adjacency_arrays(size, edges):
+    """Returns the offset and index arrays of the compressed adjacency lists
+    of a graph with size nodes and the given (source, target) edges. Helper
+    function for FeatureHierarchy.
+
+    """
+    offsets = array("l", [0] * (size + 1))
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    indices = array("l", [0] * len(edges))
+    fill = array("l", offsets[:-1])
+    for source, target in edges:
+        indices[fill[source]] = target
+        fill[source] += 1
+    return offsets, indices
+
+
+def feature_values(feature, key):
+    """Returns a list of the values of key for the feature. The key may be a
+    Feature field or the name of an attribute. Helper function for
+    GenomeAnnotation.index.
+
+    """
+    try:
+        value = getattr(feature, key)
+    except AttributeError:
+        value = feature.attributes.get(key)
+        if value is None:
+            return []
+        return value.split(",")
+    return [value]
+
+
+def parse_attributes(attribute):
+    """Returns a dictionary of the tag-value pairs in a GFF3 or GTF attribute
+    string.
+
+    """
+    attributes = {}
+    if not attribute:
+        return attributes
+    for pair in attribute.split(";"):
+        pair = pair.strip()
+        if not pair:
+            continue
+        if "=" in pair:
+            tag, value = pair.split("=", 1)
+        else:
+            tag, _, value = pair.partition(" ")
+            value = value.strip().strip('"')
+        attributes[tag.strip()] = value
+    return attributes
+
+
 def parse_gff_feature(feature_string):
     """Creates a Feature object from a GFF feature string."""
-    fields = feature_string.strip().split("\t")
-
-    while True:
-        try:
-            fields[fields.index('.')] = None
-        except ValueError:
-            break
+    fields = [None if x == '.' else x
+              for x in feature_string.rstrip("\r\n").split("\t")]
 
     sequence = fields[0]
     source = fields[1]
@@ -70,19 +414,113 @@ def parse_gff_feature(feature_string):
                    frame, attribute)
 
 
-def read_gff(gff_file):
-    """Creates a GenomeAnnotation object from a GFF file"""
+def read_gff(gff_file, cache_file=None):
+    """Creates a GenomeAnnotation object from a GFF file. If a cache_file is
+    given, the parsed annotation is loaded from it when it is up to date with
+    the GFF file, and written to it otherwise. Loading the cache is much
+    faster than parsing the GFF text. The cache also holds the feature
+    hierarchy and the indexes by ID and Parent, so these are not rebuilt;
+    other indexes are built on first use as usual. If the cache cannot be
+    written, the annotation is returned all the same.
+
+    """
+    if cache_file is not None:
+        annotation = load_gff_cache(gff_file, cache_file)
+        if annotation is not None:
+            return annotation
+
     headlines = []
     features = []
     with open(gff_file) as f:
         for line in f:
             if line.startswith("##"):
                 headlines.append(line)
-            elif line.startswith("#"):
+            elif line.startswith("#") or not line.strip():
                 pass
             else:
                 features.append(parse_gff_feature(line))
-    return GenomeAnnotation(head="".join(headlines), features=features)
+    annotation = GenomeAnnotation(head="".join(headlines), features=features)
+
+    if cache_file is not None:
+        try:
+            dump_gff_cache(annotation, gff_file, cache_file)
+        except OSError:
+            pass            # The annotation is still good without a cache,
+                            # e.g. when its directory is read-only.
+    return annotation
+
+
+def gff_signature(gff_file):
+    """Returns a tuple identifying the current version of the GFF file. Helper
+    function for the GFF cache.
+
+    """
+    stat = os.stat(gff_file)
+    return (GFF_CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+
+
+def dump_gff_cache(annotation, gff_file, cache_file):
+    """Writes the annotation parsed from gff_file, with its hierarchy and the
+    CACHED_INDEXES, to a binary cache file. The cache is written to a
+    temporary file which then replaces cache_file, so that other processes
+    never read a partly written cache.
+
+    """
+    import pickle
+    import tempfile
+    intern = sys.intern
+    rows = [(intern(f.sequence), intern(f.source), intern(f.f_type), f.start,
+             f.end, f.score, f.strand, f.frame, f.attribute)
+            for f in annotation.features]
+    hierarchy = annotation.hierarchy()
+    indexes = {}
+    for key in CACHED_INDEXES:
+        indexes[key] = {value: [hierarchy.position(f) for f in features]
+                        for value, features in annotation.index(key).items()}
+    cache = (gff_signature(gff_file), annotation.head, rows,
+             hierarchy.arrays(), indexes)
+
+    directory = os.path.dirname(os.path.abspath(cache_file))
+    with tempfile.NamedTemporaryFile("wb", dir=directory,
+                                     delete=False) as f:
+        try:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, cache_file)
+
+
+def load_gff_cache(gff_file, cache_file):
+    """Returns the GenomeAnnotation stored in the cache file, or None if the
+    cache is missing, unreadable or out of date with respect to gff_file.
+
+    """
+    import pickle
+    gc_enabled = gc.isenabled()
+    gc.disable()            # The collector is slow to no purpose while
+                            # building many objects that are all kept.
+    try:
+        with open(cache_file, "rb") as f:
+            cache = pickle.load(f)
+        if cache[0] != gff_signature(gff_file):
+            return None
+        signature, head, rows, arrays, indexes = cache
+        features = [Feature(*row) for row in rows]
+        annotation = GenomeAnnotation(head=head, features=features)
+        annotation._hierarchy = FeatureHierarchy(features, arrays)
+        for key, index in indexes.items():
+            annotation._indexes[key] = {
+                value: [features[i] for i in positions]
+                for value, positions in index.items()}
+        return annotation
+    except (OSError, EOFError, ValueError, TypeError, IndexError,
+            pickle.UnpicklingError):
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
 
 
 def in_features(reads, features):
@@ -99,3 +537,31 @@ def in_features(reads, features):
         elif f.start > r1:
             break
     return overlap
+
+
+def feature_hits(annotation, sequence, start, end, f_type="gene",
+                 exon_type="exon", cache=None):
+    """Returns a list of the features of type f_type whose exons share at
+    least one base with the range from start to end on the sequence. With
+    f_type="gene" this gives gene-level hits and with f_type="mRNA"
+    transcript-level hits. If f_type is exon_type, the exons themselves are
+    returned. A dictionary passed as cache keeps the features found for each
+    exon, for reuse by later calls with the same f_type.
+
+    """
+    exons = annotation.overlapping(sequence, start, end, exon_type)
+    if f_type == exon_type:
+        return exons
+    if cache is None:
+        cache = {}
+    hierarchy = annotation.hierarchy()
+    hits = {}
+    for exon in exons:
+        try:
+            features = cache[exon]
+        except KeyError:
+            features = hierarchy.ancestors(exon, f_type)
+            cache[exon] = features
+        for f in features:
+            hits[f] = f
+    return list(hits.values())
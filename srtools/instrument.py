@@ -0,0 +1,142 @@
+import contextlib
+import json
+import time
+from collections import Counter
+
+
+class Instrumentation(object):
+    """Counters and timings for a stream of reads, as attached to an
+    Alignment by Alignment.instrument. Time is recorded per named stage:
+
+        "read":     the total time spent producing reads from the stream
+        "io":       the part of "read" spent reading the data file
+        "parse":    the part of "read" spent parsing lines into reads
+        "filter":   the time spent in predicates passed to filter_reads
+
+    Alignments which cannot separate I/O from parsing only record "read".
+    Other stages, such as consensus calling, can be timed with the stage
+    context manager.
+
+    If a progress function is given, it is called with the Instrumentation
+    object every interval reads.
+
+    The counters keep accumulating when the alignment is rewound, so a report
+    covers every pass over it. Calling Alignment.instrument again attaches a
+    new Instrumentation, starting from zero.
+
+    """
+    def __init__(self, progress=None, interval=100000):
+        self.progress = progress
+        self.interval = interval
+        self.reads = 0
+        self.bytes = 0
+        self.filter_tested = 0
+        self.filter_passed = 0
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.started = time.perf_counter()
+        self._next_progress = interval
+
+    def add(self, stage, seconds, calls=1):
+        """Adds time spent in a stage."""
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """A context manager which adds the time spent in its body to the
+        named stage.
+
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def count_reads(self, reads):
+        """Returns a generator of the reads, counting them and timing the
+        "read" stage. Only the time spent producing the reads is measured, not
+        the time spent by the consumer.
+
+        """
+        clock = time.perf_counter
+        reads = iter(reads)
+        while True:
+            start = clock()
+            try:
+                read = next(reads)
+            except StopIteration:
+                self.add("read", clock() - start, 0)
+                return
+            self.add("read", clock() - start)
+            self.reads += 1
+            if self.progress is not None and self.reads >= self._next_progress:
+                self._next_progress += self.interval
+                self.progress(self)
+            yield read
+
+    def filter(self, function):
+        """Returns a wrapper of the predicate which times it and counts the
+        reads it tests and passes.
+
+        """
+        clock = time.perf_counter
+
+        def timed_function(read):
+            start = clock()
+            value = function(read)
+            self.add("filter", clock() - start)
+            self.filter_tested += 1
+            if value:
+                self.filter_passed += 1
+            return value
+
+        return timed_function
+
+    def report(self):
+        """Returns a dictionary summarizing the instrumentation. The keys are:
+
+            "reads":            the number of reads produced by the stream
+            "bytes":            the number of bytes of input read, where the
+                                alignment records it
+            "elapsed":          the seconds since instrumentation started
+            "reads_per_second": reads divided by elapsed
+            "stages":           a dictionary of stage names to dictionaries
+                                of "seconds", "calls" and "per_second" (calls
+                                per second spent in the stage)
+            "filter":           a dictionary of the number of reads
+                                "tested" and "passed" by filter predicates,
+                                and the "pass_rate"
+
+        """
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for name in self.seconds:
+            seconds = self.seconds[name]
+            stages[name] = {"seconds": seconds,
+                            "calls": self.calls[name],
+                            "per_second": rate(self.calls[name], seconds)}
+        return {"reads": self.reads,
+                "bytes": self.bytes,
+                "elapsed": elapsed,
+                "reads_per_second": rate(self.reads, elapsed),
+                "stages": stages,
+                "filter": {"tested": self.filter_tested,
+                           "passed": self.filter_passed,
+                           "pass_rate": rate(self.filter_passed,
+                                             self.filter_tested)}}
+
+    def to_json(self, **kwargs):
+        """Returns the report as a JSON string. Keyword arguments are passed
+        to json.dumps.
+
+        """
+        return json.dumps(self.report(), **kwargs)
+
+
+def rate(count, seconds):
+    """Returns count / seconds, or None if seconds is zero."""
+    if not seconds:
+        return None
+    return count / seconds
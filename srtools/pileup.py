@@ -1,4 +1,4 @@
-from srtools import Alignment
+from srtools.sam import Alignment
 
 class FormatError(ValueError):
     """The error raised when attempting to read from improperly formatted
@@ -1,5 +1,4 @@
 from srtools import sam
-import postgresql
 
 
 class PostgresAlignment(sam.Alignment):
@@ -8,18 +7,29 @@ class PostgresAlignment(sam.Alignment):
 
     """
     def read_generator(self):
-        with postgresql.open(self.data_file) as db:
+        with connect(self.data_file) as db:
             command = "SELECT * FROM reads ORDER BY id;"
             rows = db.prepare(command)
             for row in rows:
                 yield parse_postgres_read(row)
 
     def head(self):
-        with postgresql.open(self.data_file) as db:
+        with connect(self.data_file) as db:
             head_tuple = next(iter(db.prepare("SELECT * FROM head;")))
             return head_tuple[0]
 
 
+def connect(pq_locator):
+    """Opens the postgres database at the pg locator. The postgresql driver is
+    imported here rather than with the module, so that srtools can be used
+    without it and processes which never touch the database do not pay for
+    importing it.
+
+    """
+    import postgresql
+    return postgresql.open(pq_locator)
+
+
 def parse_postgres_read(row):
     """Returns a read object from a postgres read database row."""
     qname, flag, rname, pos, mapq,\
@@ -76,7 +86,7 @@ def sql_insert_command(read, table_name, id_number):
 
 def postgres_dump(alignment, pq_locator):
     """Dumps an alignment of SAM reads into a Postgres database"""
-    with postgresql.open(pq_locator) as db:
+    with connect(pq_locator) as db:
         db.execute("DROP TABLE IF EXISTS reads;")
         db.execute("CREATE TABLE reads ( "
                    "id          int, "
@@ -1,4 +1,11 @@
+import functools
+import itertools
+import operator
 import re
+from collections import OrderedDict
+
+
+CIGAR_CACHE_SIZE = 4096
 
 
 class UnmappedReadError(ValueError):
@@ -28,7 +35,7 @@ class Read(object):
         self.rname = str(rname)
         self.pos = int(pos)
         self.mapq = int(mapq)
-        self.cigar = Cigar(cigar)
+        self.cigar = parse_cigar(cigar)
         if rnext == "=":
             self.rnext = self.rname
         else:
@@ -38,6 +45,8 @@ class Read(object):
         self.seq = str(seq)
         self.qual = str(qual)
         self.tags = [str(x) for x in tags]
+        self._covered_range = None
+        self._raw = None
 
     def __eq__(self, other):
         return str(self) == str(other)
@@ -51,14 +60,51 @@ class Read(object):
                  self.tlen, self.seq, self.qual] + self.tags
         return "\t".join([str(x) for x in attrs])
 
+    def line(self):
+        """Returns the sam-format line of the read, without a newline. This is
+        the line the read was parsed from, if the read has not been modified
+        since, and str(read) otherwise. The check is made here, by comparing
+        the fields of the line with those of the read, so that parsing does
+        not pay for it.
+
+        """
+        raw = self._raw
+        if raw is not None:
+            fields = raw.split()
+            rnext = self.rnext
+            if fields[6] == "=" and rnext == self.rname:
+                rnext = "="
+            if fields == [self.qname, str(self.flag), self.rname,
+                          str(self.pos), str(self.mapq), str(self.cigar),
+                          rnext, str(self.pnext), str(self.tlen), self.seq,
+                          self.qual] + self.tags:
+                return raw.rstrip("\r\n")
+        return str(self)
+
     def get_covered_range(self):
         """Returns a tuple consisiting of the first and last position covered
         by the read.
 
         """
+        cached = self._covered_range
+        if (cached is not None and cached[0] == self.pos
+                and cached[1] is self.cigar):
+            return cached[2]
         first_base = self.pos
-        last_base = self.pos + sum([i for i, o in self.cigar if o == "M"]) - 1
-        return (first_base, last_base)
+        last_base = self.pos + self.cigar.match_length - 1
+        covered_range = (first_base, last_base)
+        self._covered_range = (self.pos, self.cigar, covered_range)
+        return covered_range
+
+    def aligned_blocks(self):
+        """Returns a list of (first, last) tuples of the positions covered by
+        each aligned block of the read. Deletions and skipped regions (the D
+        and N operations of spliced reads) separate the blocks.
+
+        """
+        pos = self.pos
+        return [(pos + offset, pos + offset + length - 1)
+                for offset, length in self.cigar.blocks]
 
     def has_mate_pair(read):
         """Returns true if the read has a mate pair in the alignment according
@@ -76,10 +122,34 @@ class Read(object):
 
 
 class Cigar(object):
-    """A cigar, as used in SAM-format short reads."""
+    """A cigar, as used in SAM-format short reads. Cigars are shared between
+    reads by parse_cigar, so they should be treated as immutable.
+
+    The lengths covered by the cigar are precomputed:
+
+        match_length:       the total length of the M operations
+        reference_length:   the number of reference bases spanned (M, D, N,
+                            = and X operations)
+        query_length:       the number of bases in the read sequence (M, I,
+                            S, = and X operations)
+        has_insertion:      True if the cigar contains an I operation
+        has_deletion:       True if the cigar contains a D or N operation
+        blocks:             a tuple of (offset, length) pairs of the aligned
+                            blocks (runs of M, = and X operations, split by D
+                            and N operations), with offsets from the first
+                            aligned base
+
+    """
     def __init__(self, cigar_string):
-        self.elements = [(int(a), b) for (a, b) in
-                         re.findall(r'(\d+)(\D)', cigar_string)]
+        self.elements = tuple((int(a), b) for (a, b) in
+                              re.findall(r'(\d+)(\D)', cigar_string))
+        self.match_length = sum(i for i, o in self.elements if o == "M")
+        self.reference_length = sum(i for i, o in self.elements
+                                    if o in "MDN=X")
+        self.query_length = sum(i for i, o in self.elements if o in "MIS=X")
+        self.has_insertion = any(o == "I" for i, o in self.elements)
+        self.has_deletion = any(o in "DN" for i, o in self.elements)
+        self.blocks = aligned_blocks(self.elements)
 
     def __iter__(self):
         return iter(self.elements)
@@ -101,14 +171,68 @@ class Cigar(object):
     def __ne__(self, other):
         return self.elements != other.elements
 
+    def __hash__(self):
+        return hash(self.elements)
+
+
+def aligned_blocks(elements):
+    """Returns the (offset, length) pairs of the aligned blocks of a cigar's
+    (n, operator) elements. Insertions, clips and padding do not consume the
+    reference, so they do not split a block. Helper function for Cigar.
+
+    """
+    blocks = []
+    offset = 0
+    length = 0
+    for i, o in elements:
+        if o in "M=X":
+            length += i
+        elif o in "DN":
+            if length:
+                blocks.append((offset, length))
+            offset += length + i
+            length = 0
+    if length:
+        blocks.append((offset, length))
+    return tuple(blocks)
+
+
+@functools.lru_cache(maxsize=CIGAR_CACHE_SIZE)
+def parse_cigar(cigar_string):
+    """Returns the interned Cigar object for the cigar string. Real alignments
+    contain only a few thousand distinct cigars, so most reads share a parsed
+    cigar with an earlier read. The least recently used cigars are evicted
+    once the cache holds CIGAR_CACHE_SIZE entries.
+
+    """
+    return Cigar(cigar_string)
+
+
+def cigar_cache_info():
+    """Returns the hits, misses, maxsize and currsize of the cigar cache, as a
+    named tuple.
+
+    """
+    return parse_cigar.cache_info()
+
+
+def clear_cigar_cache():
+    """Empties the cigar cache and resets its statistics."""
+    parse_cigar.cache_clear()
+
 
 class Alignment(object):
     """A sam-format sequence alignment"""
     def __init__(self, data_file):
         self.data_file = data_file
-        self.stream = self.read_generator()
+        self.instrumentation = None
+        self.rewind()
 
     def __next__(self):
+        read = self._pushback
+        if read is not None:
+            self._pushback = None
+            return read
         return next(self.stream)
 
     def __iter__(self):
@@ -119,37 +243,109 @@ class Alignment(object):
         value.
 
         """
+        if self.instrumentation is not None:
+            function = self.instrumentation.filter(function)
         for r in self:
             if function(r):
                 yield r
 
     def filter_consecutive_reads(self, function):
         """Returns a generator of consecutive reads where function(read)
-        returns a truthy value. Helper method to Alignment.collect_reads.
+        returns the same value as it does for the first read. The first read
+        which does not match is held back as the next read of the alignment,
+        so it is not lost and repeated calls step through the groups in turn.
 
         """
-        reads = iter(self)
-        first_read = next(reads)
-        test_value = function(first_read)
+        key = key_function(function)
+        try:
+            first_read = next(self)
+        except StopIteration:
+            return
+        test_value = key(first_read)
         yield first_read
         for read in self:
-            if function(read) == test_value:
-                yield read
+            if key(read) != test_value:
+                self._pushback = read
+                break
+            yield read
 
     def collect_reads(self, function):
         """Returns a generator which yields generators of consecutive reads
         which all return the same value when the specified function is applied.
+        The function may also be the name of a read attribute (e.g. "rname"),
+        which is faster than the equivalent lambda.
+
+        The alignment is consumed in a single pass with one read of lookahead,
+        as in itertools.groupby, so each group must be consumed before the
+        next one is requested.
 
         """
-        while True:
-            yield self.filter_consecutive_reads(function)
+        for _, group in itertools.groupby(self, key_function(function)):
+            yield group
+
+    def collect_read_batches(self, function, batch_size=1000):
+        """Returns a generator which yields (key, reads) tuples, where reads is
+        a list of at most batch_size consecutive reads which all return key
+        when the specified function is applied. Large groups are split across
+        several batches; a batch never spans two groups.
+
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer!")
+        for key, group in itertools.groupby(self, key_function(function)):
+            while True:
+                batch = list(itertools.islice(group, batch_size))
+                if not batch:
+                    break
+                yield (key, batch)
 
     def rewind(self):
         """Calls the read_generator method, thereby reseting the stream of
         reads.
 
         """
+        self._pushback = None
         self.stream = self.read_generator()
+        if self.instrumentation is not None:
+            self.stream = self.instrumentation.count_reads(self.stream)
+
+    def instrument(self, progress=None, interval=100000):
+        """Turns on instrumentation of the alignment and rewinds it. Returns
+        the srtools.instrument.Instrumentation object, which counts the reads
+        and records the time spent reading, parsing and filtering them. If
+        progress is given, it is called with the Instrumentation object every
+        interval reads.
+
+        """
+        from srtools.instrument import Instrumentation
+        self.instrumentation = Instrumentation(progress, interval)
+        self.rewind()
+        return self.instrumentation
+
+    def uninstrument(self):
+        """Turns off instrumentation of the alignment and rewinds it. Returns
+        the Instrumentation object that was in use, if any.
+
+        """
+        instrumentation = self.instrumentation
+        self.instrumentation = None
+        self.rewind()
+        return instrumentation
+
+    def stage(self, name):
+        """Returns a context manager which times its body as the named stage
+        of the instrumentation, for example::
+
+            with alignment.stage("consensus"):
+                seq = consensus(locus)
+
+        It does nothing if the alignment is not instrumented.
+
+        """
+        import contextlib
+        if self.instrumentation is None:
+            return contextlib.nullcontext()
+        return self.instrumentation.stage(name)
 
     def read_generator(self):
         raise NotImplementedError("Child class must provide read_generator!")
@@ -175,11 +371,64 @@ class SamAlignment(Alignment):
         return "".join(headlines)
 
     def read_generator(self):
+        if self.instrumentation is not None:
+            yield from self.instrumented_read_generator()
+            return
         with open(self.data_file) as f:
             for line in f:
                 if line and not line.startswith("@"):
                     yield parse_sam_read(line)
 
+    def instrumented_read_generator(self):
+        """A version of read_generator which records the bytes read and the
+        time spent on I/O and on parsing in the instrumentation.
+
+        """
+        import time
+        instrumentation = self.instrumentation
+        clock = time.perf_counter
+        with open(self.data_file) as f:
+            lines = iter(f)
+            while True:
+                start = clock()
+                line = next(lines, None)
+                read_time = clock()
+                instrumentation.add("io", read_time - start)
+                if line is None:
+                    return
+                instrumentation.bytes += len(line)
+                if line and not line.startswith("@"):
+                    read = parse_sam_read(line)
+                    instrumentation.add("parse", clock() - read_time)
+                    yield read
+
+    def line_batches(self, batch_size=10000):
+        """Returns a generator of lists of at most batch_size unparsed read
+        lines of the sam file, from its beginning. Lines are much cheaper to
+        send to other processes than parsed reads.
+
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer!")
+        with open(self.data_file) as f:
+            lines = (line for line in f if not line.startswith("@"))
+            while True:
+                batch = list(itertools.islice(lines, batch_size))
+                if not batch:
+                    return
+                yield batch
+
+    def write(self, path, reads=None):
+        """Writes the head and the reads (by default, the remaining reads of
+        the alignment) to a sam file with a SamWriter. Returns the number of
+        reads written.
+
+        """
+        if reads is None:
+            reads = self
+        with SamWriter(path, self.head()) as out:
+            return out.write_reads(reads)
+
     def mate_pairs(self):
         """Returns a mate pair generator, which yields mated pairs of reads.
         Calling this method on an unpaired alignment will return an empty
@@ -198,12 +447,186 @@ class SamAlignment(Alignment):
                     unpaired_reads[(read.rnext, read.pnext)] = read
 
 
+class SamWriter(object):
+    """Writes reads to a sam file, collecting lines into blocks of about
+    buffer_size characters so that large outputs are written with few system
+    calls and in constant memory. Unmodified reads are written as the lines
+    they were parsed from. Use as a context manager, or call close when
+    done::
+
+        with SamWriter("indels.sam", alignment.head()) as out:
+            out.write_reads(alignment.filter_reads(has_indel))
+
+    With append=True, the reads are added to the end of an existing file and
+    the head is not written.
+
+    """
+    def __init__(self, path, head="", buffer_size=1 << 20, append=False):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.file = open(path, "a" if append else "w")
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+        if head and not append:
+            self.file.write(head)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, read):
+        """Writes a single read."""
+        line = read.line()
+        self.buffer.append(line)
+        self.buffered += len(line) + 1
+        self.count += 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def write_reads(self, reads):
+        """Writes each of the reads, returning the number written."""
+        n = 0
+        for read in reads:
+            self.write(read)
+            n += 1
+        return n
+
+    def flush(self):
+        """Writes the buffered reads to the file."""
+        if self.buffer:
+            self.buffer.append("")
+            self.file.write("\n".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.file.flush()
+
+    def close(self):
+        """Flushes the buffered reads and closes the file."""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class ShardedSamWriter(object):
+    """Writes reads to several sam files at once, choosing a shard for each
+    read. The shard is:
+
+        by="rname":     the rname of the read, giving a file per chromosome
+        by="hash":      a stable hash of the qname modulo shards, which keeps
+                        mate pairs together
+        a function:     the value of by(read)
+
+    The file name of each shard is template.format(shard), e.g.
+    "out.{}.sam". Files are created when their first read is written, and
+    each begins with the head.
+
+    At most max_open shard files are open at once, each with a buffer of
+    about buffer_size characters, so memory and file handles stay bounded
+    however many shards there are (e.g. one per contig of a draft assembly).
+    When another file is needed, the least recently written one is closed;
+    it is reopened for appending if more of its reads arrive.
+
+    """
+    def __init__(self, template, head="", by="rname", shards=None,
+                 buffer_size=1 << 18, max_open=64):
+        if by == "rname":
+            self.shard = operator.attrgetter("rname")
+        elif by == "hash":
+            if not shards:
+                raise ValueError("Hash sharding needs a number of shards!")
+            self.shard = lambda read: qname_shard(read.qname, shards)
+        else:
+            self.shard = by
+        if max_open < 1:
+            raise ValueError("max_open must be a positive integer!")
+        self.template = template
+        self.head = head
+        self.buffer_size = buffer_size
+        self.max_open = max_open
+        self.writers = OrderedDict()    # The open writers, least recently
+                                        # used first.
+        self.created = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, read):
+        """Writes a single read to its shard."""
+        shard = self.shard(read)
+        try:
+            writer = self.writers[shard]
+        except KeyError:
+            writer = self.open(shard)
+        else:
+            self.writers.move_to_end(shard)
+        writer.write(read)
+
+    def open(self, shard):
+        """Returns a new writer for the shard, closing the least recently
+        used writer if max_open are already open.
+
+        """
+        if len(self.writers) >= self.max_open:
+            _, oldest = self.writers.popitem(last=False)
+            oldest.close()
+        writer = SamWriter(self.template.format(shard), self.head,
+                           self.buffer_size, append=shard in self.created)
+        self.created.add(shard)
+        self.writers[shard] = writer
+        return writer
+
+    def write_reads(self, reads):
+        """Writes each of the reads to its shard, returning the number
+        written.
+
+        """
+        n = 0
+        for read in reads:
+            self.write(read)
+            n += 1
+        return n
+
+    def close(self):
+        """Closes the file of every shard."""
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+def qname_shard(qname, shards):
+    """Returns the shard number of a qname, which is the same in every
+    process (unlike the built-in hash of a string).
+
+    """
+    import zlib
+    return zlib.crc32(qname.encode()) % shards
+
+
+def key_function(function):
+    """Returns a function of one read for use as a grouping key. Strings are
+    taken to be read attribute names, so that precomputed fields such as
+    "rname" or "qname" can be used without a Python-level call per read.
+
+    """
+    if isinstance(function, str):
+        return operator.attrgetter(function)
+    return function
+
+
 def parse_sam_read(string):
     """Takes a string in SAMfile format and returns a Read object."""
     fields = string.strip().split()
-    return Read(fields[0], fields[1], fields[2], fields[3], fields[4],
+    read = Read(fields[0], fields[1], fields[2], fields[3], fields[4],
                 fields[5], fields[6], fields[7], fields[8], fields[9],
                 fields[10], tags=fields[11:])
+    read._raw = string
+    return read
 
 
 def convert_indecies(cigar):
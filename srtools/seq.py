@@ -1,6 +1,5 @@
 import random
 import itertools
-from srtools import sam
 
 class NullSequenceError(ValueError):
     """The exception raised when attempting to illegally manipulate a null
@@ -94,17 +93,15 @@ def open_reading_frames(sequence):
     return orfs
 
 
-def random_sequence(length):
-    """Returns a random nucleotide sequence of the specified length."""
-    return "".join([random.choice("ACGT") for i in range(length)])
+def random_sequence(length, rng=random):
+    """Returns a random nucleotide sequence of the specified length. A seeded
+    random.Random instance may be given as rng for reproducible sequences.
+
+    """
+    return "".join(rng.choices("ACGT", k=length))
 
 
-def randomize_sequence(seq):
+def randomize_sequence(seq, rng=random):
     """Randomizes a sequence of nucleotides, preserving N's"""
-    nucs = []
-    for nucleotide in seq:
-        if nucleotide == "N":
-            nucs.append("N")
-        else:
-            nucs.append(random.choice("ACGT"))
-    return "".join(nucs)
+    bases = iter(rng.choices("ACGT", k=len(seq)))
+    return "".join(["N" if n == "N" else next(bases) for n in seq])
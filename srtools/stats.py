@@ -1,4 +1,4 @@
-from srtools import sam, seq
+from srtools import seq
 import sys
 from collections import Counter
 
@@ -53,6 +53,7 @@ def print_summary_statistics(input_file, output_file=sys.stdout):
     output file, or to stdout if not output_file is selected.
 
     """
+    from srtools import sam
     alignment = sam.SamAlignment(input_file)
     stats = summary_statistics(alignment)
 
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+from srtools import SamAlignment, counts, gff, sam
+
+
+TMP = None
+
+# G1 and G2 overlap between 1900 and 2000, on opposite strands. The exons
+# have only Parent attributes, as in TAIR and Ensembl annotations.
+GFF_LINES = ["1\tTAIR\tgene\t1000\t2000\t.\t+\t.\tID=G1",
+             "1\tTAIR\tmRNA\t1000\t2000\t.\t+\t.\tID=G1.1;Parent=G1",
+             "1\tTAIR\texon\t1000\t1200\t.\t+\t.\tParent=G1.1",
+             "1\tTAIR\texon\t1800\t2000\t.\t+\t.\tParent=G1.1",
+             "1\tTAIR\tgene\t1900\t3000\t.\t-\t.\tID=G2",
+             "1\tTAIR\tmRNA\t1900\t3000\t.\t-\t.\tID=G2.1;Parent=G2",
+             "1\tTAIR\texon\t1900\t2100\t.\t-\t.\tParent=G2.1",
+             "1\tTAIR\tgene\t5000\t6000\t.\t+\t.\tID=G3",
+             "1\tTAIR\tmRNA\t5000\t6000\t.\t+\t.\tID=G3.1;Parent=G3",
+             "1\tTAIR\texon\t5100\t6000\t.\t+\t.\tParent=G3.1"]
+
+# (qname, flag, pos, cigar) of reads on Chr1.
+READS = [("forward", 0, 1050, "20M"),             # G1
+         ("spliced", 0, 100, "10M1000N10M"),      # G1, by its second block
+         ("both", 0, 1950, "20M"),                # G1 and G2
+         ("intergenic", 0, 4000, "20M"),          # No features
+         ("unmapped", 4, 0, "*"),
+         ("reverse", 16, 5200, "20M"),            # G3
+         ("deletion", 16, 4900, "50M300D50M")]    # G3, by its second block
+
+CHROMOSOMES = {"Chr1": "1"}
+
+
+def setup_module():
+    global TMP
+    TMP = tempfile.mkdtemp()
+    with open(os.path.join(TMP, "genes.gff"), "w") as f:
+        f.write("##gff-version 3\n" + "\n".join(GFF_LINES) + "\n")
+    with open(os.path.join(TMP, "reads.sam"), "w") as f:
+        f.write("@HD\tVN:1.0\n")
+        for qname, flag, pos, cigar in READS:
+            length = sam.parse_cigar(cigar).query_length
+            if flag & 4:
+                rname, sequence, quality = "*", "*", "*"
+            else:
+                rname, sequence, quality = "Chr1", "A" * length, "I" * length
+            f.write("\t".join([qname, str(flag), rname, str(pos), "60", cigar,
+                               "*", "0", "0", sequence, quality]) + "\n")
+
+
+def teardown_module():
+    shutil.rmtree(TMP)
+
+
+def count(**kwargs):
+    return counts.count_features(
+        SamAlignment(os.path.join(TMP, "reads.sam")),
+        gff.read_gff(os.path.join(TMP, "genes.gff")),
+        chromosomes=CHROMOSOMES, **kwargs)
+
+
+def summary(result):
+    return (result["assigned"], result["unassigned_unmapped"],
+            result["unassigned_no_features"], result["unassigned_ambiguity"])
+
+
+def test_unstranded_unique():
+    result = count()
+    assert result["counts"] == {"G1": 2, "G3": 2}
+    assert summary(result) == (4, 1, 1, 1)
+
+
+def test_stranded():
+    result = count(strand="stranded")
+    assert result["counts"] == {"G1": 3}
+    assert summary(result) == (3, 1, 3, 0)
+
+
+def test_reverse_stranded():
+    result = count(strand="reverse")
+    assert result["counts"] == {"G2": 1, "G3": 2}
+    assert summary(result) == (3, 1, 3, 0)
+
+
+def test_multi_overlap_all():
+    result = count(multi_overlap="all")
+    assert result["counts"] == {"G1": 3, "G2": 1, "G3": 2}
+    assert summary(result) == (5, 1, 1, 0)
+
+
+def test_multi_overlap_fraction():
+    result = count(multi_overlap="fraction")
+    assert result["counts"] == {"G1": 2.5, "G2": 0.5, "G3": 2}
+    assert summary(result) == (5, 1, 1, 0)
+
+
+def test_transcripts():
+    result = count(f_type="mRNA")
+    assert result["counts"] == {"G1.1": 2, "G3.1": 2}
+
+
+def test_exons_without_id():
+    result = count(f_type="exon", multi_overlap="all")
+    assert result["counts"] == {"1:1000-1200": 2, "1:1800-2000": 1,
+                                "1:1900-2100": 1, "1:5100-6000": 2}
+
+
+def test_spliced_read_not_counted_in_its_intron():
+    annotation = gff.GenomeAnnotation("", [gff.parse_gff_feature(line)
+                                           for line in GFF_LINES])
+    read = sam.parse_sam_read(
+        "r\t0\tChr1\t1150\t60\t10M700N10M\t*\t0\t0\t{}\t{}".format(
+            "A" * 20, "I" * 20))
+    assert read.aligned_blocks() == [(1150, 1159), (1860, 1869)]
+    result = counts.count_features([read], annotation,
+                                   chromosomes=CHROMOSOMES)
+    assert result["counts"] == {"G1": 1}
+
+
+def test_naive_count_features():
+    annotation = gff.read_gff(os.path.join(TMP, "genes.gff"))
+    for strand in counts.STRAND_POLICIES:
+        for multi in counts.MULTI_OVERLAP_POLICIES:
+            fast = count(strand=strand, multi_overlap=multi)
+            slow = counts.naive_count_features(
+                SamAlignment(os.path.join(TMP, "reads.sam")), annotation,
+                strand=strand, multi_overlap=multi, chromosomes=CHROMOSOMES)
+            assert fast == slow, (strand, multi)
+
+
+def test_parallel():
+    for multi in counts.MULTI_OVERLAP_POLICIES:
+        assert (count(multi_overlap=multi, processes=2, batch_size=2) ==
+                count(multi_overlap=multi)), multi
+
+
+def test_parallel_needs_sam_alignment():
+    try:
+        counts.count_features([], gff.read_gff(os.path.join(TMP,
+                                                            "genes.gff")),
+                              processes=2)
+    except ValueError:
+        pass
+    else:
+        assert False, "parallel counting of a list accepted"
+
+
+def test_unknown_policy():
+    try:
+        counts.CountOptions(strand="sideways")
+    except ValueError:
+        pass
+    else:
+        assert False, "unknown strand policy accepted"
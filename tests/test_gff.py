@@ -0,0 +1,113 @@
+import os
+import pickle
+import shutil
+import tempfile
+from srtools import gff
+
+
+GFF_LINES = ["1\tTAIR\tgene\t100\t900\t.\t+\t.\tID=G1",
+             "1\tTAIR\tmRNA\t100\t900\t.\t+\t.\tID=G1.1;Parent=G1",
+             "1\tTAIR\texon\t100\t300\t.\t+\t.\tParent=G1.1",
+             "1\tTAIR\texon\t600\t900\t.\t+\t.\tParent=G1.1",
+             "1\tTAIR\tgene\t2000\t2500\t.\t-\t.\tID=G2",
+             "1\tTAIR\tmRNA\t2000\t2500\t.\t-\t.\tID=G2.1;Parent=G2",
+             "1\tTAIR\texon\t2000\t2500\t.\t-\t.\tParent=G2.1"]
+
+
+def annotation():
+    return gff.GenomeAnnotation("", [gff.parse_gff_feature(line)
+                                     for line in GFF_LINES])
+
+
+def ids(features):
+    return [f.attributes.get("ID") for f in features]
+
+
+def test_hierarchy():
+    a = annotation()
+    h = a.hierarchy()
+    gene = a.filter_features(ID="G1")[0]
+    exons = h.descendants(gene, "exon")
+    assert [(e.start, e.end) for e in exons] == [(100, 300), (600, 900)]
+    assert ids(h.ancestors(exons[1])) == ["G1", "G1.1"]
+    assert ids(h.roots()) == ["G1", "G2"]
+
+
+def test_hierarchy_after_pickling():
+    a = annotation()
+    a.hierarchy()
+    copy = pickle.loads(pickle.dumps(a))
+    h = copy.hierarchy()
+    exon = copy.filter_features(f_type="exon")[2]
+    assert ids(h.ancestors(exon, "gene")) == ["G2"]
+    assert ids(h.children(copy.features[0])) == ["G1.1"]
+
+
+def test_feature_in_two_hierarchies():
+    a = annotation()
+    h = a.hierarchy()
+    genes = gff.GenomeAnnotation("", a.filter_features(f_type="gene"))
+    genes.hierarchy()
+    assert ids(h.children(a.features[4])) == ["G2.1"]
+
+
+def test_gff_cache():
+    tmp = tempfile.mkdtemp()
+    try:
+        gff_file = os.path.join(tmp, "genes.gff")
+        cache_file = os.path.join(tmp, "genes.gff.cache")
+        with open(gff_file, "w") as f:
+            f.write("##gff-version 3\n" + "\n".join(GFF_LINES) + "\n")
+        parsed = gff.read_gff(gff_file, cache_file)
+        assert sorted(os.listdir(tmp)) == ["genes.gff", "genes.gff.cache"]
+        cached = gff.load_gff_cache(gff_file, cache_file)
+        assert cached is not None
+        assert cached.head == parsed.head == "##gff-version 3\n"
+        assert ([(f.f_type, f.start, f.attribute) for f in cached.features] ==
+                [(f.f_type, f.start, f.attribute) for f in parsed.features])
+        gene = cached.filter_features(ID="G1")[0]
+        assert ids(cached.hierarchy().children(gene)) == ["G1.1"]
+        assert len(cached.filter_features(Parent="G1.1")) == 2
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_feature_hits():
+    a = annotation()
+    assert ids(gff.feature_hits(a, "1", 250, 650)) == ["G1"]
+    assert ids(gff.feature_hits(a, "1", 250, 650, "mRNA")) == ["G1.1"]
+    assert gff.feature_hits(a, "1", 400, 500) == []
+    cache = {}
+    gff.feature_hits(a, "1", 1, 3000, cache=cache)
+    assert sorted(ids(f for fs in cache.values() for f in fs)) == \
+        ["G1", "G1", "G2"]
+
+
+def test_interval_index_with_long_feature():
+    features = [gff.Feature("1", "TAIR", "chromosome", 1, 10 ** 7, None, ".",
+                            None, "ID=1")]
+    features.extend(gff.Feature("1", "TAIR", "gene", s, s + 500, None, "+",
+                                None, "ID=G{}".format(s))
+                    for s in range(1000, 10 ** 7, 1000))
+    index = gff.IntervalIndex(features)
+    assert len(index.classes) == 2
+    for start, end in [(1, 1), (1400, 2100), (5000500, 5000600),
+                       (10 ** 7, 10 ** 7)]:
+        expected = [f for f in index.features
+                    if f.start <= end and f.end >= start]
+        assert index.overlapping(start, end) == expected
+    assert ids(index.overlapping(1400, 2100)) == ["1", "G1000", "G2000"]
+
+
+def test_gff_cache_cannot_be_written():
+    tmp = tempfile.mkdtemp()
+    try:
+        gff_file = os.path.join(tmp, "genes.gff")
+        with open(gff_file, "w") as f:
+            f.write("\n".join(GFF_LINES) + "\n")
+        cache_file = os.path.join(tmp, "missing", "genes.gff.cache")
+        annotation = gff.read_gff(gff_file, cache_file)
+        assert len(annotation.features) == len(GFF_LINES)
+        assert os.listdir(tmp) == ["genes.gff"]
+    finally:
+        shutil.rmtree(tmp)
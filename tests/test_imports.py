@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(statement):
+    """Runs the statement in a fresh interpreter and returns the set of the
+    names of the modules imported by then.
+
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c",
+         statement + "\nimport sys\nprint('\\n'.join(sys.modules))"],
+        cwd=ROOT, universal_newlines=True)
+    return set(output.split())
+
+
+def test_import_srtools_imports_no_submodules():
+    modules = imported_modules("import srtools")
+    assert "srtools" in modules
+    assert not [m for m in modules if m.startswith("srtools.")]
+
+
+def test_attributes_import_their_module():
+    modules = imported_modules("from srtools import SamAlignment")
+    assert "srtools.sam" in modules
+    assert "srtools.gff" not in modules
+    assert "srtools.instrument" not in modules
+
+
+def test_postgres_driver_not_imported():
+    modules = imported_modules("import srtools.postgres")
+    assert "srtools.postgres" in modules
+    assert "postgresql" not in modules
+
+
+def test_instrumentation_not_imported_by_reading():
+    modules = imported_modules("from srtools import SamAlignment\n"
+                               "SamAlignment(" + repr(os.devnull) + ")")
+    assert "srtools.instrument" not in modules
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+from srtools import SamAlignment
+
+
+TMP = None
+
+READS = 10
+
+
+def setup_module():
+    global TMP
+    TMP = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP)
+
+
+def alignment():
+    path = os.path.join(TMP, "reads.sam")
+    with open(path, "w") as f:
+        f.write("@HD\tVN:1.0\n")
+        for i in range(READS):
+            f.write("\t".join(["r{}".format(i), "0", "Chr1", str(i + 1), "60",
+                               "4M", "*", "0", "0", "ACGT", "IIII"]) + "\n")
+    return SamAlignment(path)
+
+
+def test_report():
+    a = alignment()
+    instrumentation = a.instrument()
+    assert sum(1 for _ in a.filter_reads(lambda r: r.pos % 2)) == 5
+    with a.stage("consensus"):
+        pass
+    report = instrumentation.report()
+    assert set(report) == set(["reads", "bytes", "elapsed",
+                               "reads_per_second", "stages", "filter"])
+    assert report["reads"] == READS
+    assert report["bytes"] == os.path.getsize(a.data_file)
+    assert set(report["stages"]) == set(["read", "io", "parse", "filter",
+                                         "consensus"])
+    assert report["stages"]["parse"]["calls"] == READS
+    assert report["stages"]["filter"]["calls"] == READS
+    assert report["stages"]["consensus"]["calls"] == 1
+    assert set(report["stages"]["read"]) == set(["seconds", "calls",
+                                                 "per_second"])
+    assert report["filter"]["tested"] == READS
+    assert report["filter"]["passed"] == 5
+    assert report["filter"]["pass_rate"] == 0.5
+
+
+def test_progress():
+    seen = []
+    a = alignment()
+    a.instrument(progress=lambda i: seen.append(i.reads), interval=3)
+    list(a)
+    assert seen == [3, 6, 9]
+
+
+def test_counts_accumulate_across_rewind():
+    a = alignment()
+    instrumentation = a.instrument()
+    list(a)
+    a.rewind()
+    list(a)
+    assert instrumentation.reads == 2 * READS
+    assert a.instrument().reads == 0
+
+
+def test_uninstrument():
+    a = alignment()
+    instrumentation = a.instrument()
+    next(a)
+    assert a.uninstrument() is instrumentation
+    assert a.instrumentation is None
+    assert a.stream.gi_code is SamAlignment.read_generator.__code__
+    assert sum(1 for _ in a) == READS
+    assert instrumentation.reads == 1
+    with a.stage("consensus"):
+        pass
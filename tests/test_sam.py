@@ -0,0 +1,260 @@
+import os
+import shutil
+import tempfile
+from srtools import SamAlignment, sam
+
+
+TMP = None
+
+LARGE = 200000
+
+
+def setup_module():
+    global TMP
+    TMP = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP)
+
+
+def write_sam(name, reads):
+    """Writes (qname, rname, pos) triples as a sam file in the temporary
+    directory and returns its path.
+
+    """
+    path = os.path.join(TMP, name)
+    with open(path, "w") as f:
+        f.write("@HD\tVN:1.0\n")
+        for qname, rname, pos in reads:
+            f.write("\t".join([qname, "0", rname, str(pos), "60", "4M", "*",
+                               "0", "0", "ACGT", "IIII"]) + "\n")
+    return path
+
+
+def empty_alignment():
+    return SamAlignment(write_sam("empty.sam", []))
+
+
+def small_alignment():
+    reads = [("r{}".format(i), rname, i + 1)
+             for i, rname in enumerate(["Chr1"] * 3 + ["Chr2"] + ["Chr3"] * 2)]
+    return SamAlignment(write_sam("small.sam", reads))
+
+
+def large_alignment(group_size):
+    """Returns an alignment of LARGE reads, in groups of group_size reads with
+    the same rname. Every read has a distinct qname.
+
+    """
+    path = os.path.join(TMP, "large{}.sam".format(group_size))
+    if not os.path.exists(path):
+        write_sam(os.path.basename(path),
+                  (("r{}".format(i), "Chr{}".format(i // group_size), i + 1)
+                   for i in range(LARGE)))
+    return SamAlignment(path)
+
+
+def test_collect_reads_empty():
+    assert list(empty_alignment().collect_reads("rname")) == []
+
+
+def test_collect_read_batches_empty():
+    assert list(empty_alignment().collect_read_batches("rname")) == []
+
+
+def test_filter_consecutive_reads_empty():
+    assert list(empty_alignment().filter_consecutive_reads("rname")) == []
+
+
+def test_collect_reads():
+    groups = [[r.qname for r in g]
+              for g in small_alignment().collect_reads(lambda r: r.rname)]
+    assert groups == [["r0", "r1", "r2"], ["r3"], ["r4", "r5"]]
+
+
+def test_collect_read_batches():
+    batches = [(k, [r.qname for r in b])
+               for k, b in small_alignment().collect_read_batches("rname", 2)]
+    assert batches == [("Chr1", ["r0", "r1"]), ("Chr1", ["r2"]),
+                       ("Chr2", ["r3"]), ("Chr3", ["r4", "r5"])]
+
+
+def test_collect_read_batches_bad_size():
+    try:
+        list(small_alignment().collect_read_batches("rname", 0))
+    except ValueError:
+        pass
+    else:
+        assert False, "batch_size 0 accepted"
+
+
+def test_filter_consecutive_reads_keeps_next_read():
+    alignment = small_alignment()
+    first = [r.qname for r in alignment.filter_consecutive_reads("rname")]
+    assert first == ["r0", "r1", "r2"]
+    assert next(alignment).qname == "r3"
+
+
+def test_filter_consecutive_reads_steps_through_groups():
+    alignment = small_alignment()
+    groups = []
+    while True:
+        group = [r.qname for r in alignment.filter_consecutive_reads("rname")]
+        if not group:
+            break
+        groups.append(group)
+    assert groups == [["r0", "r1", "r2"], ["r3"], ["r4", "r5"]]
+
+
+def test_rewind_discards_held_back_read():
+    alignment = small_alignment()
+    list(alignment.filter_consecutive_reads("rname"))
+    alignment.rewind()
+    assert next(alignment).qname == "r0"
+
+
+def test_collect_reads_large():
+    groups = large_alignment(1000).collect_reads("rname")
+    sizes = [sum(1 for _ in g) for g in groups]
+    assert len(sizes) == LARGE // 1000
+    assert set(sizes) == set([1000])
+
+
+def test_collect_reads_large_many_small_groups():
+    groups = large_alignment(1000).collect_reads("qname")
+    assert sum(1 for _ in groups) == LARGE
+
+
+def test_collect_read_batches_large():
+    batches = large_alignment(1000).collect_read_batches("rname", 300)
+    sizes = [len(b) for k, b in batches]
+    assert sum(sizes) == LARGE
+    assert max(sizes) == 300
+    assert len(sizes) == (LARGE // 1000) * 4
+
+
+def test_filter_consecutive_reads_large_many_small_groups():
+    alignment = large_alignment(2)
+    groups = 0
+    reads = 0
+    while True:
+        n = sum(1 for _ in alignment.filter_consecutive_reads("rname"))
+        if not n:
+            break
+        groups += 1
+        reads += n
+    assert groups == LARGE // 2
+    assert reads == LARGE
+
+
+def test_sam_writer_passes_through_unmodified_reads():
+    path = os.path.join(TMP, "mates.sam")
+    lines = ["r1\t99\tChr1\t10\t60\t4M\t=\t30\t24\tACGT\tIIII\tNM:i:0",
+             "r1\t147\tChr1\t30\t60\t2M1I1M\t=\t10\t-24\tACGT\tII#I"]
+    with open(path, "w") as f:
+        f.write("@HD\tVN:1.0\n" + "\n".join(lines) + "\n")
+    out = os.path.join(TMP, "mates.out.sam")
+    assert SamAlignment(path).write(out) == 2
+    with open(path) as original, open(out) as copy:
+        assert original.read() == copy.read()
+
+
+def test_sam_writer_writes_modified_reads():
+    alignment = small_alignment()
+    out = os.path.join(TMP, "modified.sam")
+    with sam.SamWriter(out) as writer:
+        for read in alignment:
+            read.pos += 100
+            writer.write(read)
+    positions = [r.pos for r in SamAlignment(out)]
+    assert positions == [101, 102, 103, 104, 105, 106]
+
+
+def read_shards(template, shards):
+    """Returns a dictionary of each shard to the (head, qnames) of its file."""
+    result = {}
+    for shard in shards:
+        path = template.format(shard)
+        if os.path.exists(path):
+            alignment = SamAlignment(path)
+            result[shard] = (alignment.head(), [r.qname for r in alignment])
+    return result
+
+
+def test_sharded_writer_keeps_mates_together():
+    reads = [("pair{}".format(i // 2), "Chr{}".format(i % 3), i + 1)
+             for i in range(200)]
+    alignment = SamAlignment(write_sam("pairs.sam", reads))
+    template = os.path.join(TMP, "hash.{}.sam")
+    with sam.ShardedSamWriter(template, alignment.head(), by="hash",
+                              shards=4) as out:
+        assert out.write_reads(alignment) == 200
+    shards = read_shards(template, range(4))
+    assert len(shards) == 4
+    qnames = []
+    for head, names in shards.values():
+        assert head == "@HD\tVN:1.0\n"
+        assert all(names.count(q) == 2 for q in names)
+        qnames.extend(names)
+    assert sorted(qnames) == sorted(q for q, r, p in reads)
+
+
+def test_sharded_writer_limits_open_files():
+    rnames = ["Chr{}".format(i % 5) for i in range(50)]
+    reads = [("r{}".format(i), rname, i + 1)
+             for i, rname in enumerate(rnames)]
+    alignment = SamAlignment(write_sam("contigs.sam", reads))
+    template = os.path.join(TMP, "contig.{}.sam")
+    with sam.ShardedSamWriter(template, alignment.head(),
+                              max_open=2) as out:
+        for read in alignment:
+            out.write(read)
+            assert len(out.writers) <= 2
+    shards = read_shards(template, set(rnames))
+    assert len(shards) == 5
+    for rname, (head, names) in shards.items():
+        assert head == "@HD\tVN:1.0\n"
+        assert names == [q for q, r, p in reads if r == rname]
+
+
+def parse(cigar, pos=10):
+    return sam.parse_sam_read("\t".join(["r", "0", "Chr1", str(pos), "60",
+                                         cigar, "*", "0", "0", "ACGT",
+                                         "IIII"]))
+
+
+def test_cigars_are_interned():
+    first, second = parse("2M1I1M"), parse("2M1I1M")
+    assert first.cigar is second.cigar
+    assert first.cigar is not parse("4M").cigar
+    assert sam.parse_cigar("2M1I1M") is first.cigar
+
+
+def test_cigar_cache_info():
+    sam.clear_cigar_cache()
+    for cigar in ["4M", "4M", "2M1I1M", "4M"]:
+        parse(cigar)
+    info = sam.cigar_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 2, 2)
+    assert info.maxsize == sam.CIGAR_CACHE_SIZE
+
+
+def test_cigar_lengths():
+    cigar = sam.parse_cigar("2S3M1I2M5N4M2D1M")
+    assert cigar.match_length == 10
+    assert cigar.reference_length == 17
+    assert cigar.query_length == 13
+    assert cigar.has_insertion and cigar.has_deletion
+    assert cigar.blocks == ((0, 5), (10, 4), (16, 1))
+    assert not sam.parse_cigar("4M").has_insertion
+
+
+def test_covered_range_follows_changes():
+    read = parse("4M")
+    assert read.get_covered_range() == (10, 13)
+    read.pos = 20
+    assert read.get_covered_range() == (20, 23)
+    read.cigar = sam.parse_cigar("10M")
+    assert read.get_covered_range() == (20, 29)
+    assert read.aligned_blocks() == [(20, 29)]